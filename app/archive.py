@@ -0,0 +1,31 @@
+"""
+Ротация опубликованных постов в помесячные архивные листы.
+
+Запуск (например, раз в сутки из cron или systemd-таймера):
+    python -m app.archive
+    python -m app.archive --days 14 --max-rows 1000
+"""
+import argparse
+import logging
+
+from .sheets import rotate_posted, ARCHIVE_AFTER_DAYS, HOT_SHEET_MAX_ROWS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+log = logging.getLogger("travelluck.archive")
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос posted-записей в архивные листы")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help=f"архивировать posted старше N дней (по умолчанию {ARCHIVE_AFTER_DAYS})")
+    parser.add_argument("--max-rows", type=int, default=HOT_SHEET_MAX_ROWS,
+                        help=f"максимум строк в рабочем листе (по умолчанию {HOT_SHEET_MAX_ROWS})")
+    args = parser.parse_args()
+
+    moved = rotate_posted(max_age_days=args.days, max_hot_rows=args.max_rows)
+    log.info("Archived rows: %d", moved)
+
+if __name__ == "__main__":
+    main()
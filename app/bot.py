@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import time
 from datetime import datetime, timezone
 
 from telegram import Update, InputFile
@@ -9,10 +10,12 @@ from telegram.ext import (
 )
 
 from .config import TELEGRAM_TOKEN
-from .generate import generate_post
+from .generate import generate_post, GENERATION_DEADLINE_SECONDS
 from .sheets import (
     append_post, get_post_by_id, list_recent_posts, delete_post, update_post_fields
 )
+from .search import search_posts
+from .dedup import find_similar
 
 # -------------------- Логирование --------------------
 logging.basicConfig(
@@ -30,6 +33,12 @@ def chunk_text(s: str, max_len: int = 3500):
 def sanitize_plain(s: str) -> str:
     return (s or "").replace("\r", "").strip()
 
+def format_similar(items: list[dict]) -> str:
+    return "\n".join(
+        f"{p['id']} — {p['title'] or '(без названия)'} ({int(p['similarity'] * 100)}%)"
+        for p in items
+    )
+
 # -------------------- Команды --------------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log.info("/start from chat_id=%s", update.effective_chat.id)
@@ -37,8 +46,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Привет! Я бот-редактор тревел-постов.\n"
         "Команды:\n"
         "/newpost <тема> — сгенерировать черновик и сохранить в Google Sheets\n"
+        "/newpost --force <тема> — то же, без проверки на похожие посты\n"
         "/list — показать последние записи\n"
         "/list <id> — показать запись целиком\n"
+        "/search <запрос> — найти посты по заголовку, тексту и промпту\n"
         "/edit <id> — отредактировать title, text, image_prompt\n"
         "/delete <id> — удалить запись"
     )
@@ -53,12 +64,41 @@ async def newpost(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Укажи тему: /newpost Париж весной")
         return
 
-    topic = " ".join(context.args).strip()
-    log.info("/newpost topic='%s' chat_id=%s", topic, update.effective_chat.id)
+    args = list(context.args)
+    force = args[0] == "--force"
+    if force:
+        args = args[1:]
+    topic = " ".join(args).strip()
+    if not topic:
+        await update.message.reply_text("Укажи тему: /newpost Париж весной")
+        return
+    log.info("/newpost topic='%s' force=%s chat_id=%s", topic, force, update.effective_chat.id)
+
+    # Проверка на почти-дубликаты до платной генерации
+    if not force:
+        try:
+            similar = await asyncio.to_thread(find_similar, topic)
+        except Exception as e:
+            log.exception("find_similar failed for topic='%s': %s", topic, e)
+            similar = []
+        if similar:
+            log.info("/newpost topic='%s' looks like: %s", topic, [p["id"] for p in similar])
+            msg = (
+                "Похожие посты уже есть:\n"
+                f"{format_similar(similar)}\n\n"
+                "Посмотреть: /list <id>\n"
+                f"Если всё равно нужен новый пост: /newpost --force {topic}"
+            )
+            for part in chunk_text(msg):
+                await update.message.reply_text(part)
+            return
+
     await update.message.reply_text(f"Генерирую пост про: {topic} ...")
+    # Отсчёт бюджета — после проверки на дубли: первая проверка может строить индекс из таблицы
+    deadline = time.monotonic() + GENERATION_DEADLINE_SECONDS
 
     try:
-        post = await generate_post(topic)
+        post = await generate_post(topic, deadline=deadline)
         log.info("Generated post: title='%s...' image_url='%s' has_bytes=%s",
                  (post.get('title') or "")[:60],
                  post.get('image_url') or "",
@@ -87,6 +127,13 @@ async def newpost(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except Exception as e:
                 log.exception("Failed to upload photo to Telegram: %s", e)
 
+        # Заголовок модель могла сформулировать ближе к существующему посту, чем тему
+        try:
+            similar_title = await asyncio.to_thread(find_similar, title)
+        except Exception as e:
+            log.exception("find_similar failed for title='%s': %s", title, e)
+            similar_title = []
+
         row_id = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")
         created_at = datetime.now(timezone.utc).isoformat()
 
@@ -120,6 +167,8 @@ async def newpost(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 preview_plain += "(Сохранено как Telegram file_id — подходит для повторной отправки этим ботом)\n"
         else:
             preview_plain += "\nImage: not generated or not uploaded ❌\n"
+        if similar_title:
+            preview_plain += f"\n⚠️ Похожие заголовки уже есть:\n{format_similar(similar_title)}\n"
 
         for part in chunk_text(preview_plain):
             await update.message.reply_text(part)
@@ -182,6 +231,35 @@ async def list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text("Последние записи:\n" + "\n".join(lines))
 
+# -------------------- SEARCH --------------------
+async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text("Укажи запрос: /search Париж весной")
+        return
+
+    query = " ".join(context.args).strip()
+    log.info("/search query='%s' chat_id=%s", query, update.effective_chat.id)
+    try:
+        # Первый вызов может построить индекс из таблицы — не блокируем event loop
+        results = await asyncio.to_thread(search_posts, query, 10)
+    except Exception as e:
+        log.exception("search_posts failed for query='%s': %s", query, e)
+        await update.message.reply_text("Ошибка поиска.")
+        return
+
+    if not results:
+        await update.message.reply_text("Ничего не найдено.")
+        return
+
+    lines = []
+    for p in results:
+        t = (p.get("title") or "").strip().replace("\n", " ")
+        if len(t) > 80:
+            t = t[:77] + "..."
+        lines.append(f"{p['id']} — {t or '(без названия)'}")
+
+    await update.message.reply_text("Найдено:\n" + "\n".join(lines))
+
 # -------------------- EDIT (Conversation) --------------------
 EDIT_TITLE, EDIT_TEXT, EDIT_IMAGE_PROMPT = range(3)
 
@@ -352,6 +430,7 @@ def main():
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("newpost", newpost))
     app.add_handler(CommandHandler("list", list_cmd))
+    app.add_handler(CommandHandler("search", search_cmd))
 
     # Edit conversation
     edit_handler = ConversationHandler(
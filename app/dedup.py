@@ -0,0 +1,212 @@
+import base64
+import hashlib
+import logging
+import os
+import zlib
+from array import array
+
+from .search import JournaledIndex, normalize_tokens
+
+try:
+    from .config import DEDUP_INDEX_PATH
+except ImportError:
+    DEDUP_INDEX_PATH = "data/dedup_index.json"
+
+try:
+    from .config import DEDUP_THRESHOLD
+except ImportError:
+    DEDUP_THRESHOLD = 0.5
+
+# --------- Логирование ----------
+log = logging.getLogger("travelluck.dedup")
+
+# MinHash: 64 хеш-функции, LSH: 16 полос по 4 строки — кандидаты с Jaccard от ~0.5.
+# Кандидатов затем проверяем точно по сохранённым множествам шинглов.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Сколько первых букв слова используется для поиска кандидатов по покрытию темы
+PREFIX_LEN = 3
+# Доля шинглов слова темы, которая должна найтись в заголовке, чтобы слово считалось покрытым
+WORD_COVERAGE = 0.5
+
+def _word_shingles(token: str) -> set[int]:
+    padded = f" {token} "
+    return {zlib.crc32(padded[i:i + 3].encode("utf-8")) for i in range(len(padded) - 2)}
+
+def shingles(s: str) -> set[int]:
+    """
+    Символьные 3-граммы по нормализованным словам.
+    Порядок слов не важен: «Париж весной» и «весенний Париж» дают близкие множества.
+    """
+    out = set()
+    for token in normalize_tokens(s):
+        out |= _word_shingles(token)
+    return out
+
+def _prefixes(s: str) -> set[str]:
+    return {t[:PREFIX_LEN] for t in normalize_tokens(s)}
+
+def _hash_vector(x: int) -> array:
+    # NUM_PERM независимых 32-битных хешей одного шингла за один вызов SHAKE
+    return array("I", hashlib.shake_128(x.to_bytes(4, "little")).digest(4 * NUM_PERM))
+
+def minhash(sh: set[int]) -> list[int]:
+    if not sh:
+        return []
+    return [min(col) for col in zip(*(_hash_vector(x) for x in sh))]
+
+def _pack(values) -> str:
+    # Компактное хранение на диске: uint32-массив в base64 вместо JSON-списка чисел
+    return base64.b64encode(array("I", values).tobytes()).decode("ascii")
+
+def _unpack(data: str) -> list[int]:
+    arr = array("I")
+    arr.frombytes(base64.b64decode(data))
+    return arr.tolist()
+
+def _bands(sig: list[int]) -> list[str]:
+    return [f"{i}:{hash(tuple(sig[i * ROWS:(i + 1) * ROWS]))}" for i in range(BANDS)]
+
+# --------- LSH-индекс ----------
+class DedupIndex(JournaledIndex):
+    """
+    Индекс заголовков постов для поиска почти-дубликатов.
+    На диске: docs: id -> {"title", "sig": MinHash, "sh": шинглы}.
+    Корзины LSH и индекс префиксов слов пересобираются в памяти при загрузке.
+    """
+
+    name = "Dedup index"
+    FIELDS = ("id", "title")
+
+    def __init__(self, path: str = DEDUP_INDEX_PATH):
+        super().__init__(path)
+        self._reset()
+
+    def _reset(self):
+        self.docs: dict[str, dict] = {}
+        self.buckets: dict[str, set[str]] = {}
+        self.prefixes: dict[str, set[str]] = {}
+
+    def _snapshot(self) -> dict:
+        return {"docs": {
+            pid: {"title": d["title"], "sig": _pack(d["sig"]), "sh": _pack(sorted(d["sh"]))}
+            for pid, d in self.docs.items()
+        }}
+
+    def _restore(self, data: dict):
+        self._reset()
+        for pid, doc in (data.get("docs") or {}).items():
+            sig = _unpack(doc["sig"])
+            self.docs[pid] = {"title": doc["title"], "sig": sig, "sh": set(_unpack(doc["sh"]))}
+            self._bucket_add(pid, sig, doc["title"])
+
+    def _bucket_add(self, pid: str, sig: list[int], title: str):
+        for key in _bands(sig):
+            self.buckets.setdefault(key, set()).add(pid)
+        for key in _prefixes(title):
+            self.prefixes.setdefault(key, set()).add(pid)
+
+    @staticmethod
+    def _discard(table: dict[str, set[str]], keys, pid: str):
+        for key in keys:
+            ids = table.get(key)
+            if ids is None:
+                continue
+            ids.discard(pid)
+            if not ids:
+                del table[key]
+
+    def _remove(self, post_id: str):
+        doc = self.docs.pop(post_id, None)
+        if not doc:
+            return
+        self._discard(self.buckets, _bands(doc["sig"]), post_id)
+        self._discard(self.prefixes, _prefixes(doc["title"]), post_id)
+
+    def _add(self, post: dict):
+        post_id = str(post.get("id") or "")
+        title = post.get("title", "")
+        sh = shingles(title)
+        if not post_id or not sh:
+            return
+        sig = minhash(sh)
+        self.docs[post_id] = {"title": title, "sig": sig, "sh": sh}
+        self._bucket_add(post_id, sig, title)
+
+    def query(self, text: str, threshold: float = DEDUP_THRESHOLD, limit: int = 5) -> list[dict]:
+        """
+        Возвращает посты, похожие на text, по убыванию похожести.
+        Дубль — это либо Jaccard по шинглам >= threshold (кандидаты из LSH),
+        либо тема из 2+ слов, каждое из которых покрыто заголовком:
+        «Париж весной» ~ «Весенний Париж: сады и кафе», но «Грузия летом» не ~ «Горы Грузии зимой»,
+        а однословная «Турция» не ~ «Морской отдых в Турции».
+        """
+        words = normalize_tokens(text)
+        sh = shingles(text)
+        if not sh:
+            return []
+        sig = minhash(sh)
+        word_sh = [_word_shingles(w) for w in set(words)]
+        out = []
+        with self._lock:
+            candidates = set()
+            for key in _bands(sig):
+                candidates |= self.buckets.get(key, set())
+            covered_candidates = set()
+            if len(word_sh) >= 2:
+                # Заголовки, где есть слова на те же первые буквы, что и все слова темы
+                postings = sorted((self.prefixes.get(p, set()) for p in {w[:PREFIX_LEN] for w in words}), key=len)
+                covered_candidates = set(postings[0]).intersection(*postings[1:])
+            for pid in candidates | covered_candidates:
+                doc = self.docs[pid]
+                inter = len(sh & doc["sh"])
+                score = inter / len(sh | doc["sh"])
+                if pid in covered_candidates and all(
+                    len(ws & doc["sh"]) >= WORD_COVERAGE * len(ws) for ws in word_sh
+                ):
+                    score = max(score, inter / len(sh))
+                if score >= threshold:
+                    out.append({"id": pid, "title": doc["title"], "similarity": round(score, 2)})
+        out.sort(key=lambda d: (-d["similarity"], d["id"]))
+        return out[:limit]
+
+# --------- Глобальный индекс ---------
+_index: DedupIndex | None = None
+
+def get_index() -> DedupIndex:
+    """Загружает индекс с диска; если файла нет — строит его один раз из таблицы."""
+    global _index
+    if _index is not None and _index.is_stale():
+        log.info("Dedup index was invalidated by another process — reloading")
+        _index = None
+    if _index is None:
+        idx = DedupIndex()
+        if not idx.load():
+            from .sheets import iter_all_posts
+            log.info("Dedup index not found at %s — building from sheet", idx.path)
+            idx.rebuild(iter_all_posts())
+        _index = idx
+    return _index
+
+def find_similar(text: str, threshold: float = DEDUP_THRESHOLD, limit: int = 5) -> list[dict]:
+    return get_index().query(text, threshold=threshold, limit=limit)
+
+def _needs_update() -> bool:
+    # Если индекс не строился или признан устаревшим, он будет собран целиком при первой проверке
+    global _index
+    if _index is not None and _index.is_stale():
+        _index = None
+    return _index is not None or os.path.exists(DEDUP_INDEX_PATH)
+
+def on_post_saved(post: dict):
+    if _needs_update():
+        get_index().upsert(post)
+
+def on_post_deleted(post_id: str):
+    if _needs_update():
+        get_index().remove(post_id)
+
+def invalidate():
+    DedupIndex().invalidate()
@@ -0,0 +1,4 @@
+from .transfer import main_export
+
+if __name__ == "__main__":
+    main_export()
@@ -1,9 +1,11 @@
 import asyncio
 import io
 import logging
+import time
+from collections import deque
 from datetime import datetime, timezone
 
-import requests
+import httpx
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -17,6 +19,26 @@ from .config import (
     # (опционально) GOOGLE_DRIVE_FOLDER_ID
 )
 
+try:
+    from .config import STABILITY_HEDGE_MODEL  # "ultra" | "core" | "sd3"
+except ImportError:
+    STABILITY_HEDGE_MODEL = "core"
+
+try:
+    from .config import IMAGE_HEDGE_PERCENTILE
+except ImportError:
+    IMAGE_HEDGE_PERCENTILE = 0.9
+
+try:
+    from .config import IMAGE_HEDGE_DEFAULT_DELAY
+except ImportError:
+    IMAGE_HEDGE_DEFAULT_DELAY = 45.0  # сек., пока нет статистики
+
+try:
+    from .config import GENERATION_DEADLINE_SECONDS
+except ImportError:
+    GENERATION_DEADLINE_SECONDS = 150.0  # бюджет на весь /newpost: текст + картинка
+
 # --------- Логирование ----------
 log = logging.getLogger("travelluck.generate")
 
@@ -73,12 +95,30 @@ def _text_system_prompt() -> str:
         "Верни JSON с ключами: title, text, image_prompt."
     )
 
-async def generate_text(topic: str) -> dict:
+def _fallback_text(topic: str) -> dict:
+    return {
+        "title": f"{topic}: вдохновляющий маршрут",
+        "text": (
+            f"Путешествие на тему «{topic}». Составьте свой маршрут, "
+            f"запланируйте ключевые точки и оставьте время для импровизаций."
+        ),
+        "image_prompt": f"{topic}, scenic landscape, photorealistic, golden hour, no people, 1:1"
+    }
+
+async def generate_text(topic: str, deadline: float | None = None) -> dict:
+    """deadline — момент по time.monotonic(); если OpenAI не успевает, возвращаем запасной текст."""
     client = _openai_client()
-    log.info("OpenAI text generation for topic='%s'", topic)
+    if deadline is None:
+        deadline = time.monotonic() + GENERATION_DEADLINE_SECONDS
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        log.warning("[generate_text] дедлайн уже истёк — использую запасной текст.")
+        return _fallback_text(topic)
+    log.info("OpenAI text generation for topic='%s' (budget %.1fs)", topic, remaining)
 
     def _call():
         resp = client.chat.completions.create(
+            timeout=remaining,
             model="gpt-4o-mini",
             temperature=0.8,
             messages=[
@@ -89,7 +129,12 @@ async def generate_text(topic: str) -> dict:
         )
         return resp.choices[0].message.content
 
-    raw = await asyncio.to_thread(_call)
+    try:
+        # timeout= ограничивает сам HTTP-запрос, wait_for — ожидание потока на случай ретраев клиента
+        raw = await asyncio.wait_for(asyncio.to_thread(_call), timeout=remaining)
+    except (asyncio.TimeoutError, TimeoutError):
+        log.error("[generate_text] OpenAI не уложился в %.1fs — использую запасной текст.", remaining)
+        return _fallback_text(topic)
 
     import json
     try:
@@ -102,47 +147,125 @@ async def generate_text(topic: str) -> dict:
         }
     except Exception as e:
         log.error("[generate_text] JSON parse error: %s; raw=%s", e, raw[:300])
-        return {
-            "title": f"{topic}: вдохновляющий маршрут",
-            "text": (
-                f"Путешествие на тему «{topic}». Составьте свой маршрут, "
-                f"запланируйте ключевые точки и оставьте время для импровизаций."
-            ),
-            "image_prompt": f"{topic}, scenic landscape, photorealistic, golden hour, no people, 1:1"
-        }
+        return _fallback_text(topic)
 
 # --------- Stability image generation ----------
-async def generate_image(image_prompt: str) -> bytes | None:
-    if not STABILITY_API_KEY:
-        log.warning("[generate_image] STABILITY_API_KEY отсутствует — пропускаю генерацию.")
-        return None
+STABILITY_API_HOST = "https://api.stability.ai"
+STABILITY_ENDPOINTS = {
+    "ultra": "/v2beta/stable-image/generate/ultra",
+    "core": "/v2beta/stable-image/generate/core",
+    "sd3": "/v2beta/stable-image/generate/sd3",
+}
+PRIMARY_MODEL = "ultra"
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных запросов по каждой модели."""
+
+    MIN_SAMPLES = 10
+
+    def __init__(self, window: int = 200):
+        self._samples: dict[str, deque] = {}
+        self._window = window
+
+    def record(self, model: str, seconds: float):
+        self._samples.setdefault(model, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, model: str, p: float) -> float | None:
+        samples = self._samples.get(model)
+        if not samples or len(samples) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
 
-    api_host = "https://api.stability.ai"
-    url = f"{api_host}/v2beta/stable-image/generate/ultra"
+latency = LatencyTracker()
+
+def hedge_delay() -> float:
+    """Через сколько секунд ожидания основного запроса запускать страхующий."""
+    p = latency.percentile(PRIMARY_MODEL, IMAGE_HEDGE_PERCENTILE)
+    return IMAGE_HEDGE_DEFAULT_DELAY if p is None else p
+
+async def _stability_request(client: httpx.AsyncClient, model: str, image_prompt: str, timeout: float) -> bytes:
+    url = f"{STABILITY_API_HOST}{STABILITY_ENDPOINTS[model]}"
     headers = {"authorization": f"Bearer {STABILITY_API_KEY}", "accept": "image/*"}
-    files = {
-        "prompt": (None, image_prompt),
-        "mode": (None, "text-to-image"),
-        "output_format": (None, "jpeg"),
-    }
+    data = {"prompt": image_prompt, "output_format": "jpeg"}
+    if model in ("ultra", "sd3"):
+        data["mode"] = "text-to-image"
 
+    started = time.monotonic()
     try:
-        log.info("Requesting Stability Ultra image for prompt: %s", image_prompt)
-        resp = await asyncio.to_thread(
-            requests.post, url, headers=headers, files=files, timeout=120
-        )
+        log.info("Requesting Stability %s image for prompt: %s", model, image_prompt)
+        # files={"none": ""} — чтобы httpx отправил multipart/form-data, как требует API
+        resp = await client.post(url, headers=headers, data=data, files={"none": ""}, timeout=timeout)
         if resp.status_code != 200:
-            log.error("[generate_image] HTTP %s: %s", resp.status_code, resp.text[:500])
+            log.error("[generate_image] %s HTTP %s: %s", model, resp.status_code, resp.text[:500])
             resp.raise_for_status()
-        log.info("Stability image generated: %d bytes", len(resp.content))
-        return resp.content
-    except Exception as e:
-        log.error("[generate_image] Ошибка Stability: %s", e)
+    except asyncio.CancelledError:
+        # Запрос проиграл гонку: его настоящая длительность не меньше прошедшего времени.
+        # Пишем нижнюю оценку, иначе перцентиль занижался бы медленными отменёнными запросами.
+        latency.record(model, time.monotonic() - started)
+        raise
+    elapsed = time.monotonic() - started
+    latency.record(model, elapsed)
+    log.info("Stability %s image generated: %d bytes in %.1fs", model, len(resp.content), elapsed)
+    return resp.content
+
+async def generate_image(image_prompt: str, deadline: float | None = None) -> bytes | None:
+    """
+    Генерация картинки с хеджированием.
+    Основной запрос идёт в Ultra; если он не ответил за hedge_delay() (перцентиль
+    IMAGE_HEDGE_PERCENTILE по недавним запросам) или упал — параллельно запускается
+    страхующий запрос в STABILITY_HEDGE_MODEL. Берём первый успешный ответ, второй отменяем.
+    deadline — момент по time.monotonic(), после которого картинка уже не нужна.
+    """
+    if not STABILITY_API_KEY:
+        log.warning("[generate_image] STABILITY_API_KEY отсутствует — пропускаю генерацию.")
+        return None
+
+    if deadline is None:
+        deadline = time.monotonic() + GENERATION_DEADLINE_SECONDS
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        log.warning("[generate_image] дедлайн уже истёк — пропускаю генерацию.")
         return None
 
+    async with httpx.AsyncClient() as client:
+        pending = {asyncio.create_task(_stability_request(client, PRIMARY_MODEL, image_prompt, remaining))}
+        hedged = False
+        delay = hedge_delay()
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    log.error("[generate_image] дедлайн истёк, отменяю запросы")
+                    return None
+                wait_for = remaining if hedged else min(delay, remaining)
+                done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    log.error("[generate_image] Ошибка Stability: %s", task.exception())
+
+                # Либо основной запрос медлит дольше перцентиля, либо упал — страхуемся
+                remaining = deadline - time.monotonic()
+                if not hedged and remaining > 0:
+                    hedged = True
+                    log.info("Hedging image request with %s (delay=%.1fs, remaining=%.1fs)",
+                             STABILITY_HEDGE_MODEL, delay, remaining)
+                    pending.add(asyncio.create_task(
+                        _stability_request(client, STABILITY_HEDGE_MODEL, image_prompt, remaining)
+                    ))
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
 # --------- Публичная функция ---------
-async def generate_post(topic: str) -> dict:
+async def generate_post(topic: str, deadline: float | None = None) -> dict:
     """
+    deadline — момент по time.monotonic(), к которому нужен результат (см. generate_image).
     Возвращает словарь:
     {
       "title": str, "text": str, "image_prompt": str,
@@ -151,6 +274,8 @@ async def generate_post(topic: str) -> dict:
     }
     """
     log.info("generate_post started for topic='%s'", topic)
+    if deadline is None:
+        deadline = time.monotonic() + GENERATION_DEADLINE_SECONDS
 
     fallback = {
         "title": f"{topic}: заметки путешественника",
@@ -161,8 +286,8 @@ async def generate_post(topic: str) -> dict:
     }
 
     try:
-        text_part = await generate_text(topic)
-        img_bytes = await generate_image(text_part.get("image_prompt", ""))
+        text_part = await generate_text(topic, deadline=deadline)
+        img_bytes = await generate_image(text_part.get("image_prompt", ""), deadline=deadline)
 
         image_url = ""
         image_bytes_out = None
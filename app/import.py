@@ -0,0 +1,5 @@
+# Имя модуля — ключевое слово, поэтому он только для запуска: python -m app.import
+from .transfer import main_import
+
+if __name__ == "__main__":
+    main_import()
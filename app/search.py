@@ -0,0 +1,363 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from .storage import load_json, save_json
+
+try:
+    from .config import SEARCH_INDEX_PATH
+except ImportError:
+    SEARCH_INDEX_PATH = "data/search_index.json"
+
+# --------- Логирование ----------
+log = logging.getLogger("travelluck.search")
+
+# Вес полей при ранжировании: совпадение в заголовке важнее, чем в тексте
+FIELD_WEIGHTS = {"title": 3, "text": 1, "image_prompt": 1}
+
+# BM25
+_K1 = 1.2
+_B = 0.75
+
+# Сколько изменений копим в журнале, прежде чем переписать снимок целиком
+JOURNAL_COMPACT_EVERY = 500
+
+# --------- Нормализация RU/EN ----------
+# Меняется вместе с правилами нормализации: индексы со старой версией пересобираются
+NORMALIZATION_VERSION = 3
+
+# Любые буквы и цифры: названия вроде «Kraków» или «Ørsted» не должны рваться на части
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+_RU_SUFFIXES = sorted([
+    "иями", "ями", "ами", "ией", "иях", "ого", "его", "ому", "ему", "ыми", "ими",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой", "ей", "ом", "ем", "ым", "им",
+    "ую", "юю", "ах", "ях", "ов", "ев", "ам", "ям", "ию", "ия", "ии", "ью",
+    "ешь", "ет", "ете", "ут", "ют", "ат", "ят", "ить", "ать", "ять", "еть", "ться", "тся",
+    "ость", "ости", "ство", "ства",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+
+_EN_SUFFIXES = sorted([
+    "ing", "edly", "ed", "ly", "ment", "ness",
+], key=len, reverse=True)
+
+_STOPWORDS = {
+    "и", "в", "во", "на", "с", "со", "к", "ко", "по", "о", "об", "от", "до", "из", "за",
+    "для", "не", "что", "как", "это", "а", "но", "или", "у",
+    "the", "a", "an", "and", "or", "of", "in", "on", "to", "for", "with", "no", "by", "at", "is",
+}
+
+def _en_singular(token: str) -> str:
+    # cities -> city, beaches/boxes -> beach/box, places/tours -> place/tour; bus, glass, paris не трогаем
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if token.endswith(("ches", "shes", "sses", "xes", "zes")):
+        return token[:-2]
+    if token.endswith("s") and not token.endswith(("ss", "us", "is")) and len(token) > 3:
+        return token[:-1]
+    return token
+
+def _stem(token: str) -> str:
+    if re.search("[а-я]", token):
+        suffixes = _RU_SUFFIXES
+    else:
+        token = _en_singular(token)
+        suffixes = _EN_SUFFIXES
+    for suf in suffixes:
+        if token.endswith(suf) and len(token) - len(suf) >= 3:
+            return token[:-len(suf)]
+    return token
+
+def _fold_latin(s: str) -> str:
+    """Málaga -> malaga, Zürich -> zurich. Кириллицу не трогаем: й не должна превращаться в и."""
+    out = []
+    for ch in s:
+        if ch.isascii():
+            out.append(ch)
+            continue
+        base = unicodedata.normalize("NFKD", ch)[0]
+        out.append(base if "a" <= base <= "z" else ch)
+    return "".join(out)
+
+def normalize_tokens(s: str) -> list[str]:
+    """Нижний регистр, ё→е, диакритика латиницы, разбиение на слова, стоп-слова, грубый стемминг."""
+    s = _fold_latin((s or "").lower().replace("ё", "е"))
+    return [_stem(t) for t in _TOKEN_RE.findall(s) if t not in _STOPWORDS]
+
+# --------- Хранение на диске ----------
+class JournaledIndex:
+    """
+    Локальный индекс: снимок в JSON + журнал изменений (JSONL) рядом с ним.
+    Правка поста дописывает одну строку в журнал, а не переписывает весь снимок;
+    раз в JOURNAL_COMPACT_EVERY изменений журнал сворачивается в новый снимок.
+    Наследники реализуют _reset/_add/_remove/_snapshot/_restore.
+
+    Файл <path>.generation — метка поколения. Другой процесс (python -m app.import)
+    меняет её через invalidate(); снимок и строки журнала со старой меткой игнорируются,
+    а процесс, чья копия устарела, ничего не пишет на диск и пересобирает индекс.
+    """
+
+    name = "index"
+    FIELDS: tuple[str, ...] = ("id",)
+
+    def __init__(self, path: str):
+        self.path = path
+        self.journal_path = f"{path}.log"
+        self.generation_path = f"{path}.generation"
+        self._generation = ""
+        self._journal_len = 0
+        self._lock = threading.Lock()
+
+    # ---- поколение ----
+    def _read_generation(self) -> str:
+        try:
+            with open(self.generation_path, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ""
+
+    def is_stale(self) -> bool:
+        return self._read_generation() != self._generation
+
+    def invalidate(self):
+        """Объявляет индекс на диске устаревшим для всех процессов."""
+        d = os.path.dirname(self.generation_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        tmp = f"{self.generation_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(time.time_ns()))
+        os.replace(tmp, self.generation_path)
+        for path in (self.path, self.journal_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        log.info("%s at %s invalidated", self.name, self.path)
+
+    # ---- загрузка / сохранение ----
+    def load(self) -> bool:
+        self._generation = self._read_generation()
+        data = load_json(self.path)
+        if not data:
+            return False
+        if data.get("version") != NORMALIZATION_VERSION:
+            log.info("%s at %s is outdated — will rebuild", self.name, self.path)
+            return False
+        if data.get("generation", "") != self._generation:
+            log.info("%s at %s was invalidated — will rebuild", self.name, self.path)
+            return False
+        self._restore(data)
+        # Повтор журнала идемпотентен: upsert = remove + add
+        self._journal_len = 0
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        break  # недописанная строка после сбоя
+                    if rec.get("g", "") != self._generation:
+                        continue
+                    self._remove(rec["id"])
+                    if rec.get("op") == "upsert":
+                        self._add(rec["post"])
+                    self._journal_len += 1
+        except FileNotFoundError:
+            pass
+        log.info("%s loaded: %d docs (+%d journaled)", self.name, len(self.docs), self._journal_len)
+        return True
+
+    def save(self):
+        if self.is_stale():
+            log.info("%s is stale — skip saving, will rebuild", self.name)
+            return
+        save_json(self.path, {
+            "version": NORMALIZATION_VERSION,
+            "generation": self._generation,
+            **self._snapshot(),
+        })
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+        self._journal_len = 0
+
+    def _journal(self, rec: dict):
+        if self.is_stale():
+            return
+        rec["g"] = self._generation
+        if self._journal_len + 1 >= JOURNAL_COMPACT_EVERY:
+            self.save()
+            return
+        d = os.path.dirname(self.journal_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._journal_len += 1
+
+    # ---- изменения ----
+    def upsert(self, post: dict, persist: bool = True):
+        post_id = str(post.get("id") or "")
+        with self._lock:
+            self._remove(post_id)
+            self._add(post)
+            if persist:
+                self._journal({
+                    "op": "upsert", "id": post_id,
+                    "post": {k: post.get(k, "") for k in self.FIELDS},
+                })
+
+    def remove(self, post_id: str, persist: bool = True):
+        with self._lock:
+            self._remove(post_id)
+            if persist:
+                self._journal({"op": "remove", "id": post_id})
+
+    def rebuild(self, posts):
+        with self._lock:
+            # Метку читаем до чтения таблицы: если импорт закончится во время сборки, она устареет
+            self._generation = self._read_generation()
+            self._reset()
+            for p in posts:
+                self._add(p)
+            self.save()
+        log.info("%s rebuilt: %d docs", self.name, len(self.docs))
+
+# --------- Инвертированный индекс ----------
+class SearchIndex(JournaledIndex):
+    """
+    Инвертированный индекс по title/text/image_prompt.
+    docs:     id -> {"title", "created_at", "len", "tf": {term: weight}}
+    postings: term -> {id: weight}
+    """
+
+    name = "Search index"
+    FIELDS = ("id", "title", "text", "image_prompt", "created_at")
+
+    def __init__(self, path: str = SEARCH_INDEX_PATH):
+        super().__init__(path)
+        self._reset()
+
+    def _reset(self):
+        self.docs: dict[str, dict] = {}
+        self.postings: dict[str, dict[str, int]] = {}
+        self._total_len = 0
+
+    def _snapshot(self) -> dict:
+        return {"docs": self.docs, "postings": self.postings}
+
+    def _restore(self, data: dict):
+        self.docs = data.get("docs") or {}
+        self.postings = data.get("postings") or {}
+        self._total_len = sum(d.get("len", 0) for d in self.docs.values())
+
+    def _remove(self, post_id: str):
+        doc = self.docs.pop(post_id, None)
+        if not doc:
+            return
+        self._total_len -= doc.get("len", 0)
+        for term in doc.get("tf", {}):
+            plist = self.postings.get(term)
+            if plist is None:
+                continue
+            plist.pop(post_id, None)
+            if not plist:
+                del self.postings[term]
+
+    def _add(self, post: dict):
+        post_id = str(post.get("id") or "")
+        if not post_id:
+            return
+        tf: dict[str, int] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in normalize_tokens(post.get(field, "")):
+                tf[term] = tf.get(term, 0) + weight
+        length = sum(tf.values())
+        self.docs[post_id] = {
+            "title": post.get("title", ""),
+            "created_at": post.get("created_at", ""),
+            "len": length,
+            "tf": tf,
+        }
+        self._total_len += length
+        for term, w in tf.items():
+            self.postings.setdefault(term, {})[post_id] = w
+
+    # ---- поиск ----
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        terms = set(normalize_tokens(query))
+        if not terms:
+            return []
+        scores: dict[str, float] = {}
+        with self._lock:
+            # Статистику корпуса читаем под замком: upsert может идти из другого потока
+            n = len(self.docs)
+            if not n:
+                return []
+            avg_len = (self._total_len / n) or 1.0
+            for term in terms:
+                plist = self.postings.get(term)
+                if not plist:
+                    continue
+                idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+                for pid, tf in plist.items():
+                    dl = self.docs[pid]["len"]
+                    norm = tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * dl / avg_len))
+                    scores[pid] = scores.get(pid, 0.0) + idf * norm
+            ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+            return [
+                {
+                    "id": pid,
+                    "title": self.docs[pid]["title"],
+                    "created_at": self.docs[pid]["created_at"],
+                    "score": round(score, 3),
+                }
+                for pid, score in ranked
+            ]
+
+# --------- Глобальный индекс ---------
+_index: SearchIndex | None = None
+
+def get_index() -> SearchIndex:
+    """Загружает индекс с диска; если файла нет — строит его один раз из таблицы."""
+    global _index
+    if _index is not None and _index.is_stale():
+        log.info("Search index was invalidated by another process — reloading")
+        _index = None
+    if _index is None:
+        idx = SearchIndex()
+        if not idx.load():
+            from .sheets import iter_all_posts
+            log.info("Search index not found at %s — building from sheet", idx.path)
+            idx.rebuild(iter_all_posts())
+        _index = idx
+    return _index
+
+def search_posts(query: str, limit: int = 10) -> list[dict]:
+    return get_index().search(query, limit=limit)
+
+def _needs_update() -> bool:
+    # Если индекс не строился или признан устаревшим, он будет собран целиком при первом поиске
+    global _index
+    if _index is not None and _index.is_stale():
+        _index = None
+    return _index is not None or os.path.exists(SEARCH_INDEX_PATH)
+
+def on_post_saved(post: dict):
+    if _needs_update():
+        get_index().upsert(post)
+
+def on_post_deleted(post_id: str):
+    if _needs_update():
+        get_index().remove(post_id)
+
+def invalidate():
+    SearchIndex().invalidate()
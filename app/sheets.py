@@ -1,7 +1,24 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
 import gspread
 from .config import GOOGLE_SHEETS_SPREADSHEET_ID, GOOGLE_SERVICE_ACCOUNT_JSON
+from . import search, dedup
+
+try:
+    from .config import ARCHIVE_AFTER_DAYS
+except ImportError:
+    ARCHIVE_AFTER_DAYS = 30
+
+try:
+    from .config import HOT_SHEET_MAX_ROWS
+except ImportError:
+    HOT_SHEET_MAX_ROWS = 2000
+
+log = logging.getLogger("travelluck.sheets")
 
 SHEET_NAME = "posts"
+ARCHIVE_PREFIX = "archive_"  # помесячные архивы: archive_2025-03
 HEADERS = [
     "id","status","post","image_prompt","image_url",
     "created_at","scheduled_at","posted_at","chat_id","message_id","error"
@@ -10,8 +27,11 @@ HEADERS = [
 def _client():
     return gspread.service_account(filename=GOOGLE_SERVICE_ACCOUNT_JSON)
 
+def _open_spreadsheet(gc):
+    return gc.open_by_key(GOOGLE_SHEETS_SPREADSHEET_ID)
+
 def _open_sheet(gc):
-    sh = gc.open_by_key(GOOGLE_SHEETS_SPREADSHEET_ID)
+    sh = _open_spreadsheet(gc)
     try:
         ws = sh.worksheet(SHEET_NAME)
     except gspread.exceptions.WorksheetNotFound:
@@ -49,6 +69,140 @@ def _parse_post_cell(cell: str) -> tuple[str, str]:
             return title, (rest or "").strip()
     return "", cell
 
+def _row_to_post(row: list[str]) -> dict:
+    title, text = _parse_post_cell(row[2] if len(row) > 2 else "")
+    return {
+        "id": row[0],
+        "status": row[1] if len(row) > 1 else "",
+        "title": title,
+        "text": text,
+        "image_prompt": row[3] if len(row) > 3 else "",
+        "image_url": row[4] if len(row) > 4 else "",
+        "created_at": row[5] if len(row) > 5 else ""
+    }
+
+# -------------------- Синхронизация локальных индексов --------------------
+def _index_saved(post: dict):
+    # Ошибка индекса не должна ломать запись в таблицу
+    for index in (search, dedup):
+        try:
+            index.on_post_saved(post)
+        except Exception as e:
+            log.error("[_index_saved] %s id=%s: %s", index.__name__, post.get("id"), e)
+
+def _index_deleted(post_id: str):
+    for index in (search, dedup):
+        try:
+            index.on_post_deleted(post_id)
+        except Exception as e:
+            log.error("[_index_deleted] %s id=%s: %s", index.__name__, post_id, e)
+
+def iter_all_posts():
+    """Все посты из рабочего листа и архивов (один полный проход — для первичной сборки индексов)."""
+    gc = _client()
+    ws = _open_sheet(gc)
+    sheets = [ws] + [w for w in ws.spreadsheet.worksheets() if w.title.startswith(ARCHIVE_PREFIX)]
+    for w in sheets:
+        for row in w.get_all_values()[1:]:
+            if not row or len(row) < 3 or not row[0]:
+                continue
+            yield _row_to_post(row)
+
+# -------------------- Архивы --------------------
+def _archive_title(post_id: str) -> str | None:
+    """
+    Маршрутизация в архив по месяцу создания.
+    id от /newpost имеет вид YYYYmmddHHMMSSffffff, поэтому месяц берём прямо из него.
+    Для любых других id (например, импортированных) возвращает None: такие строки
+    остаются в рабочем листе, иначе _locate не смог бы их найти.
+    """
+    try:
+        datetime.strptime(post_id, "%Y%m%d%H%M%S%f")
+    except ValueError:
+        return None
+    if len(post_id) != 20:
+        return None
+    return f"{ARCHIVE_PREFIX}{post_id[:4]}-{post_id[4:6]}"
+
+def _open_archive(sh, title: str, create: bool = False):
+    try:
+        return sh.worksheet(title)
+    except gspread.exceptions.WorksheetNotFound:
+        if not create:
+            return None
+        ws = sh.add_worksheet(title=title, rows=100, cols=len(HEADERS))
+        ws.append_row(HEADERS)
+        return ws
+
+def _find_row(ws, post_id: str) -> tuple[int | None, list[str]]:
+    all_values = ws.get_all_values()
+    for idx, row in enumerate(all_values[1:], start=2):  # с учётом заголовка
+        if row and row[0] == post_id:
+            return idx, row
+    return None, []
+
+def _locate(gc, post_id: str):
+    """
+    Ищет строку сначала в рабочем листе, затем в архиве нужного месяца.
+    Возвращает (ws, индекс строки 1-based, row) или (None, None, []).
+    """
+    ws = _open_sheet(gc)
+    idx, row = _find_row(ws, post_id)
+    if idx:
+        return ws, idx, row
+
+    title = _archive_title(post_id)
+    if not title:
+        return None, None, []
+    aws = _open_archive(ws.spreadsheet, title)
+    if aws is None:
+        return None, None, []
+    idx, row = _find_row(aws, post_id)
+    if idx:
+        log.info("Post id=%s found in archive %s", post_id, title)
+        return aws, idx, row
+    return None, None, []
+
+# -------------------- Для массовых операций (app.transfer) --------------------
+def open_worksheet(sheet_name: str = SHEET_NAME):
+    """Рабочий лист или архив по имени; None, если такого архива нет."""
+    ws = _open_sheet(_client())
+    if sheet_name == SHEET_NAME:
+        return ws
+    return _open_archive(ws.spreadsheet, sheet_name)
+
+def record_to_row(rec: dict, current: list[str] | None = None) -> list[str]:
+    """
+    Строка листа из записи: принимает и «сырой» формат (колонка post), и раздельные title/text.
+    current — текущая строка с тем же id: меняются только колонки, которые есть в записи,
+    а пустой status не сбрасывает опубликованный пост обратно в draft.
+    """
+    rec = {k: "" if v is None else str(v) for k, v in rec.items()}
+    row = (list(current or []) + [""] * len(HEADERS))[:len(HEADERS)]
+    if not rec.get("post") and ("title" in rec or "text" in rec):
+        title, text = _parse_post_cell(row[HEADERS.index("post")])
+        rec["post"] = _pack_post_cell(rec.get("title", title), rec.get("text", text))
+    if not rec.get("status"):
+        if current is None:
+            rec["status"] = "draft"
+        else:
+            rec.pop("status", None)
+    for i, h in enumerate(HEADERS):
+        if h in rec:
+            row[i] = rec[h]
+    return row
+
+def invalidate_indexes():
+    """
+    Объявляет локальные индексы устаревшими после записи в обход append_post.
+    Бот пересоберёт их из таблицы при следующем /search или /newpost.
+    """
+    for index in (search, dedup):
+        try:
+            index.invalidate()
+        except Exception as e:
+            log.error("[invalidate_indexes] %s: %s", index.__name__, e)
+
 # -------------------- Добавление поста --------------------
 def append_post(row_dict: dict) -> dict:
     gc = _client()
@@ -70,7 +224,7 @@ def append_post(row_dict: dict) -> dict:
         row_dict.get("error",""),
     ]
     ws.append_row(row, value_input_option="RAW")
-    return {
+    saved = {
         "id": row[0],
         "status": row[1],
         "title": row_dict.get("title",""),
@@ -79,29 +233,16 @@ def append_post(row_dict: dict) -> dict:
         "image_url": row[4],
         "created_at": row[5]
     }
+    _index_saved(saved)
+    return saved
 
 # -------------------- Получение по id --------------------
 def get_post_by_id(post_id: str) -> dict | None:
     gc = _client()
-    ws = _open_sheet(gc)
-    all_values = ws.get_all_values()
-    for row in all_values[1:]:
-        if not row or len(row) < 3:
-            continue
-        if row[0] == post_id:
-            title, text = _parse_post_cell(row[2])
-            image_prompt = row[3] if len(row) > 3 else ""
-            image_url = row[4] if len(row) > 4 else ""
-            return {
-                "id": row[0],
-                "status": row[1],
-                "title": title,
-                "text": text,
-                "image_prompt": image_prompt,
-                "image_url": image_url,
-                "created_at": row[5] if len(row) > 5 else ""
-            }
-    return None
+    _, idx, row = _locate(gc, post_id)
+    if not idx or len(row) < 3:
+        return None
+    return _row_to_post(row)
 
 # -------------------- Последние N --------------------
 def list_recent_posts(limit: int = 10) -> list[dict]:
@@ -133,28 +274,15 @@ def update_post_fields(post_id: str, title: str | None = None, text: str | None
     Если параметр = None — поле не меняется.
     """
     gc = _client()
-    ws = _open_sheet(gc)
-    all_values = ws.get_all_values()
-
-    # найдём строку и текущее состояние
-    target_idx = None  # индекс строки в таблице (1-based)
-    cur_title = ""
-    cur_text = ""
-    cur_image_prompt = ""
-
-    for idx, row in enumerate(all_values[1:], start=2):  # с учётом заголовка
-        if not row:
-            continue
-        if row[0] == post_id:
-            target_idx = idx
-            pt, tx = _parse_post_cell(row[2] if len(row) > 2 else "")
-            cur_title, cur_text = pt, tx
-            cur_image_prompt = row[3] if len(row) > 3 else ""
-            break
 
+    # найдём строку (в рабочем листе или в архиве) и текущее состояние
+    ws, target_idx, cur_row = _locate(gc, post_id)  # индекс строки в таблице (1-based)
     if not target_idx:
         return False
 
+    cur_title, cur_text = _parse_post_cell(cur_row[2] if len(cur_row) > 2 else "")
+    cur_image_prompt = cur_row[3] if len(cur_row) > 3 else ""
+
     new_title = cur_title if title is None else title
     new_text = cur_text if text is None else text
     new_ip = cur_image_prompt if image_prompt is None else image_prompt
@@ -162,17 +290,129 @@ def update_post_fields(post_id: str, title: str | None = None, text: str | None
     # Обновим объединённую ячейку поста и image_prompt
     ws.update_cell(target_idx, 3, _pack_post_cell(new_title, new_text))  # col 3 = "post"
     ws.update_cell(target_idx, 4, new_ip)  # col 4 = "image_prompt"
+
+    post = _row_to_post(cur_row)
+    post.update(title=new_title, text=new_text, image_prompt=new_ip)
+    _index_saved(post)
     return True
 
 # -------------------- Удаление --------------------
 def delete_post(post_id: str) -> bool:
+    gc = _client()
+    ws, idx, _ = _locate(gc, post_id)
+    if not idx:
+        return False
+    ws.delete_rows(idx)
+    _index_deleted(post_id)
+    return True
+
+# -------------------- Ротация в архив --------------------
+def _parse_ts(value: str) -> datetime | None:
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def _post_age_ts(row: list[str]) -> datetime | None:
+    posted_at = row[7] if len(row) > 7 else ""
+    created_at = row[5] if len(row) > 5 else ""
+    return _parse_ts(posted_at) or _parse_ts(created_at)
+
+def rotate_posted(max_age_days: int | None = None, max_hot_rows: int | None = None) -> int:
+    """
+    Переносит опубликованные (status=posted) строки в помесячные архивы:
+    - всё, что опубликовано раньше max_age_days назад;
+    - плюс самые старые posted, если рабочий лист длиннее max_hot_rows.
+    Черновики никогда не трогаем. Сначала копируем, потом удаляем одним batch-запросом,
+    поэтому прерванная ротация оставит дубль, а не потеряет запись.
+    Возвращает число перенесённых строк.
+    """
+    max_age_days = ARCHIVE_AFTER_DAYS if max_age_days is None else max_age_days
+    max_hot_rows = HOT_SHEET_MAX_ROWS if max_hot_rows is None else max_hot_rows
+    cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+
     gc = _client()
     ws = _open_sheet(gc)
+    sh = ws.spreadsheet
     all_values = ws.get_all_values()
+
+    posted = []  # (индекс строки 1-based, row) в порядке листа — от старых к новым
     for idx, row in enumerate(all_values[1:], start=2):
-        if not row:
-            continue
-        if row[0] == post_id:
-            ws.delete_rows(idx)
-            return True
-    return False
+        if row and row[0] and len(row) > 1 and row[1] == "posted":
+            if _archive_title(row[0]) is None:
+                log.warning("rotate_posted: can't route id=%s — stays in hot sheet", row[0])
+                continue
+            posted.append((idx, row))
+
+    selected = {}
+    for idx, row in posted:
+        ts = _post_age_ts(row)
+        if ts and ts < cutoff:
+            selected[idx] = row
+
+    # Ограничение размера рабочего листа
+    overflow = (len(all_values) - 1) - len(selected) - max_hot_rows
+    for idx, row in posted:
+        if overflow <= 0:
+            break
+        if idx not in selected:
+            selected[idx] = row
+            overflow -= 1
+
+    if not selected:
+        log.info("rotate_posted: nothing to archive")
+        return 0
+
+    # Копирование: одна пачка append_rows на каждый месяц
+    groups: dict[str, list[list[str]]] = {}
+    for idx in sorted(selected):
+        groups.setdefault(_archive_title(selected[idx][0]), []).append(idx)
+
+    moved_ids = set()
+    for title, idxs in groups.items():
+        aws = _open_archive(sh, title, create=True)
+        existing = set(aws.col_values(1))
+        rows = []
+        for idx in idxs:
+            row = selected[idx]
+            if row[0] not in existing:
+                rows.append((row + [""] * len(HEADERS))[:len(HEADERS)])
+        if rows:
+            aws.append_rows(rows, value_input_option="RAW")
+        moved_ids.update(selected[idx][0] for idx in idxs)
+        log.info("rotate_posted: %d rows -> %s", len(rows), title)
+
+    if not moved_ids:
+        return 0
+
+    # Пока шло копирование, /newpost или /delete могли сдвинуть строки.
+    # Поэтому индексы для удаления берём из свежего чтения колонки id, а не из get_all_values выше.
+    moved = [
+        idx for idx, pid in enumerate(ws.col_values(1), start=1)
+        if idx > 1 and pid in moved_ids
+    ]
+    if not moved:
+        return 0
+
+    # Удаление: непрерывные диапазоны снизу вверх, одним batch_update
+    ranges = []
+    for idx in sorted(moved, reverse=True):
+        if ranges and ranges[-1][0] == idx + 1:
+            ranges[-1][0] = idx
+        else:
+            ranges.append([idx, idx])
+    sh.batch_update({"requests": [
+        {"deleteDimension": {"range": {
+            "sheetId": ws.id,
+            "dimension": "ROWS",
+            "startIndex": start - 1,
+            "endIndex": end,
+        }}}
+        for start, end in ranges
+    ]})
+    log.info("rotate_posted: archived %d rows in %d ranges", len(moved), len(ranges))
+    return len(moved)
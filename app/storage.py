@@ -0,0 +1,27 @@
+import json
+import logging
+import os
+
+# --------- Логирование ----------
+log = logging.getLogger("travelluck.storage")
+
+# --------- Локальные JSON-файлы (индексы, checkpoint'ы) ----------
+def load_json(path: str) -> dict | None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.error("[load_json] повреждённый файл %s: %s", path, e)
+        return None
+
+def save_json(path: str, data: dict):
+    """Атомарная запись: пишем во временный файл и подменяем."""
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
@@ -0,0 +1,212 @@
+"""
+Потоковый экспорт/импорт листа постов в JSONL или CSV.
+
+    python -m app.export -o posts.jsonl
+    python -m app.export -o posts.csv --sheet archive_2025-03
+    python -m app.import posts.jsonl
+    python -m app.import posts.csv --batch 1000
+
+Экспорт читает лист диапазонами по --chunk строк и сразу пишет их в файл,
+поэтому память не зависит от размера таблицы.
+Импорт пишет пачками: новые id — одним append_rows, существующие — одним batch_update
+поверх текущей строки (меняются только колонки, которые есть в записи).
+После каждой пачки сохраняется checkpoint, и прерванный импорт продолжается с того же места.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+from .storage import load_json, save_json
+from .sheets import HEADERS, SHEET_NAME, open_worksheet, record_to_row, invalidate_indexes
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+log = logging.getLogger("travelluck.transfer")
+
+LAST_COL = chr(64 + len(HEADERS))
+
+class Throughput:
+    """Счётчик строк/сек для отчёта в лог."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def add(self, n: int):
+        self.rows += n
+        log.info("%s: %d rows (%.0f rows/s)", self.label, self.rows, self.rate())
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def done(self):
+        elapsed = time.monotonic() - self.started
+        log.info("%s done: %d rows in %.1fs (%.0f rows/s)", self.label, self.rows, elapsed, self.rate())
+
+def _open_target(sheet_name: str):
+    ws = open_worksheet(sheet_name)
+    if ws is None:
+        raise SystemExit(f"Лист {sheet_name!r} не найден")
+    return ws
+
+def _detect_format(path: str, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+def _pad(row: list[str]) -> list[str]:
+    return (list(row) + [""] * len(HEADERS))[:len(HEADERS)]
+
+# -------------------- Экспорт --------------------
+def iter_sheet_chunks(ws, chunk: int):
+    """Строки листа (без заголовка) пачками по chunk через диапазонные чтения."""
+    total = ws.row_count
+    start = 2
+    while start <= total:
+        end = min(start + chunk - 1, total)
+        rows = ws.get(f"A{start}:{LAST_COL}{end}")
+        yield [_pad(r) for r in rows if r and r[0]]
+        start = end + 1
+
+def export_posts(out, fmt: str, sheet_name: str = SHEET_NAME, chunk: int = 1000) -> int:
+    ws = _open_target(sheet_name)
+    meter = Throughput(f"export {sheet_name}")
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(HEADERS)
+    for rows in iter_sheet_chunks(ws, chunk):
+        for row in rows:
+            if writer:
+                writer.writerow(row)
+            else:
+                out.write(json.dumps(dict(zip(HEADERS, row)), ensure_ascii=False) + "\n")
+        meter.add(len(rows))
+    meter.done()
+    return meter.rows
+
+# -------------------- Импорт --------------------
+def _iter_records(path: str, fmt: str):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+def _appended_start_row(resp: dict) -> int | None:
+    # updatedRange вида "posts!A120:K169"
+    rng = ((resp or {}).get("updates") or {}).get("updatedRange", "")
+    cell = rng.split("!")[-1].split(":")[0]
+    digits = cell.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+    return int(digits) if digits.isdigit() else None
+
+def import_posts(path: str, fmt: str, sheet_name: str = SHEET_NAME, batch: int = 500,
+                 checkpoint: str | None = None) -> int:
+    checkpoint = checkpoint or f"{path}.checkpoint"
+    state = load_json(checkpoint) or {}
+    skip = int(state.get("done", 0))
+    if skip:
+        log.info("Resuming import from record %d (checkpoint %s)", skip, checkpoint)
+
+    ws = _open_target(sheet_name)
+    # Только колонка id: нужна, чтобы обновлять существующие записи, а не дублировать их
+    row_of = {pid: idx for idx, pid in enumerate(ws.col_values(1), start=1) if idx > 1 and pid}
+    meter = Throughput(f"import {sheet_name}")
+
+    def flush(records: list[dict], done: int):
+        # Повтор id внутри пачки: сливаем записи, иначе оба попали бы в append_rows
+        merged: dict[str, dict] = {}
+        for rec in records:
+            pid = str(rec["id"])
+            merged[pid] = {**merged.get(pid, {}), **rec}
+        # Текущие строки существующих id — одним запросом, чтобы не затереть колонки, которых нет в записи
+        existing = [pid for pid in merged if pid in row_of]
+        current = {}
+        if existing:
+            ranges = [f"A{row_of[pid]}:{LAST_COL}{row_of[pid]}" for pid in existing]
+            current = {pid: (vr[0] if vr else []) for pid, vr in zip(existing, ws.batch_get(ranges))}
+        new_rows, updates = [], []
+        for pid, rec in merged.items():
+            row = record_to_row(rec, current.get(pid))
+            if pid in current:
+                idx = row_of[pid]
+                updates.append({"range": f"A{idx}:{LAST_COL}{idx}", "values": [row]})
+            else:
+                new_rows.append(row)
+        if updates:
+            ws.batch_update(updates, value_input_option="RAW")
+        if new_rows:
+            resp = ws.append_rows(new_rows, value_input_option="RAW")
+            start = _appended_start_row(resp)
+            if start:
+                for offset, row in enumerate(new_rows):
+                    row_of[row[0]] = start + offset
+        save_json(checkpoint, {"input": os.path.abspath(path), "done": done})
+        meter.add(len(merged))
+
+    pending: list[dict] = []
+    done = 0
+    try:
+        for rec in _iter_records(path, fmt):
+            done += 1
+            if done <= skip:
+                continue
+            if not rec.get("id"):
+                log.warning("Record %d has no id — skipped", done)
+                continue
+            pending.append(rec)
+            if len(pending) >= batch:
+                flush(pending, done)
+                pending = []
+        if pending:
+            flush(pending, done)
+    finally:
+        # Индексы бота не трогаем построчно: другой процесс держит их в памяти.
+        # Метка поколения заставит его пересобрать их из таблицы — в том числе после сбоя импорта.
+        if meter.rows:
+            invalidate_indexes()
+
+    meter.done()
+    try:
+        os.remove(checkpoint)
+    except FileNotFoundError:
+        pass
+    return meter.rows
+
+# -------------------- CLI --------------------
+def main_export(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.export", description="Экспорт постов в JSONL/CSV")
+    parser.add_argument("-o", "--output", default="-", help="файл (по умолчанию stdout)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="по умолчанию — по расширению файла")
+    parser.add_argument("--sheet", default=SHEET_NAME, help=f"лист (по умолчанию {SHEET_NAME})")
+    parser.add_argument("--chunk", type=int, default=1000, help="строк на одно чтение")
+    args = parser.parse_args(argv)
+
+    fmt = _detect_format(args.output, args.format)
+    if args.output == "-":
+        export_posts(sys.stdout, fmt, args.sheet, args.chunk)
+    else:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            export_posts(out, fmt, args.sheet, args.chunk)
+
+def main_import(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.import", description="Импорт постов из JSONL/CSV")
+    parser.add_argument("input", help="файл JSONL или CSV")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="по умолчанию — по расширению файла")
+    parser.add_argument("--sheet", default=SHEET_NAME, help=f"лист (по умолчанию {SHEET_NAME})")
+    parser.add_argument("--batch", type=int, default=500, help="строк на один запрос записи")
+    parser.add_argument("--checkpoint", help="файл прогресса (по умолчанию <input>.checkpoint)")
+    args = parser.parse_args(argv)
+
+    import_posts(args.input, _detect_format(args.input, args.format), args.sheet, args.batch, args.checkpoint)